@@ -15,6 +15,9 @@ from ..genericPyTorchModel import GenericPyTorchModel
 from ..functional._retinanet import DEFAULT_OPTIONS, collation, encoder, loss
 from ..functional._retinanet.model import RetinaNet as Model
 from ..functional.datasets.bboxDataset import BoundingBoxesDataset
+from ..functional._util.prefetcher import CudaPrefetcher
+from ..functional._util.progress import ProgressThrottler
+from ..functional._util.compile import CompiledForward
 from util.helpers import get_class_executable
 from util import optionsHelper
 
@@ -358,6 +361,61 @@ class RetinaNet(GenericPyTorchModel):
 
 
 
+    def _get_dataloader_kwargs(self, stage, device):
+        '''
+            Assembles the keyword arguments for the PyTorch DataLoader of the
+            given stage ('train' or 'inference') from the model options.
+            Enables pinned (page-locked) host memory if the model runs on a
+            CUDA device, so that batches can be copied asynchronously with
+            "non_blocking=True".
+            If background workers are requested, they are kept alive for the
+            lifetime of the DataLoader and prefetch up to four batches each.
+        '''
+        kwargs = {
+            'batch_size': int(optionsHelper.get_hierarchical_value(self.options, ['options', stage, 'dataLoader', 'batch_size', 'value'], fallback=1)),
+            'shuffle': (stage == 'train' and optionsHelper.get_hierarchical_value(self.options, ['options', 'train', 'dataLoader', 'shuffle', 'value'], fallback=True)),
+            'pin_memory': ('cuda' in device)
+        }
+        numWorkers = int(optionsHelper.get_hierarchical_value(self.options, ['options', stage, 'dataLoader', 'num_workers', 'value'], fallback=0))
+        if numWorkers > 0:
+            # PyTorch only accepts these arguments for multi-process loading
+            kwargs['num_workers'] = numWorkers
+            kwargs['persistent_workers'] = True
+            kwargs['prefetch_factor'] = max(1, min(4, int(optionsHelper.get_hierarchical_value(self.options, ['options', stage, 'dataLoader', 'prefetch_factor', 'value'], fallback=2))))
+        return kwargs
+
+
+    def _compile_model(self, model, device, mode=None):
+        '''
+            Returns a callable for the model's forward pass that uses a compiled
+            version of it (torch.compile; PyTorch >= 2.0) if enabled in the
+            options, supported by the installed PyTorch version and running on
+            a CUDA device. Returns the original model otherwise.
+            The compiled model shares its parameters with the original one;
+            model states should still be exported from the latter. It is kept
+            per model instance and mode, so that repeated calls (e.g. once per
+            inference chunk) do not compile the model again.
+        '''
+        if not optionsHelper.get_hierarchical_value(self.options, ['options', 'general', 'compile_model', 'value'], fallback=False) or \
+            'cuda' not in device or not hasattr(torch, 'compile'):
+            return model
+        cached = getattr(self, '_compiledModel', None)
+        if cached is None or cached[0] is not model or cached[1] != mode:
+            try:
+                compiled = torch.compile(model, mode=mode)
+            except Exception as e:
+                print(f'WARNING: could not compile model (message: "{str(e)}"); falling back to eager mode.')
+                compiled = None
+            cached = (model, mode, CompiledForward(model, compiled))
+            self._compiledModel = cached
+        return cached[2]
+
+
+    def _get_progress_interval(self):
+        return float(optionsHelper.get_hierarchical_value(self.options, ['options', 'general', 'progress_interval', 'value'], fallback=0.5))
+
+
+
     ''' Model training and inference functionalities '''
 
     def train(self, stateDict, data, updateStateFun):
@@ -393,10 +451,11 @@ class RetinaNet(GenericPyTorchModel):
             maxIoU_neg=optionsHelper.get_hierarchical_value(self.options, ['options', 'train', 'encoding', 'maxIoU_neg', 'value'], fallback=0.4)
         )
         collator = collation.Collator(self.project, self.dbConnector, (inputSize[1], inputSize[0],), dataEncoder)
+        device = self.get_device()
         dataLoader = DataLoader(
             dataset=dataset,
             collate_fn=collator.collate_fn,
-            shuffle=optionsHelper.get_hierarchical_value(self.options, ['options', 'train', 'dataLoader', 'shuffle', 'value'], fallback=True)
+            **self._get_dataloader_kwargs('train', device)
         )
 
         # optimizer
@@ -415,38 +474,44 @@ class RetinaNet(GenericPyTorchModel):
             if key not in optionsHelper.RESERVED_KEYWORDS:
                 critArgs_out[key] = optionsHelper.get_hierarchical_value(critArgs[key], ['value'])
         criterion = loss.FocalLoss(**critArgs_out)
+        try:
+            # compile to fuse element-wise operations and reduce intermediate tensors
+            criterion = torch.jit.script(criterion)
+        except Exception as e:
+            print(f'WARNING: could not compile loss criterion (message: "{str(e)}"); falling back to eager mode.')
 
         # train model
-        device = self.get_device()
         seed = int(optionsHelper.get_hierarchical_value(self.options, ['options', 'general', 'seed', 'value'], fallback=0))
         torch.manual_seed(seed)
         if 'cuda' in device:
             torch.cuda.manual_seed(seed)
+            torch.backends.cudnn.benchmark = True   # input size is fixed
         model.to(device)
+        model_fwd = self._compile_model(model, device, 'reduce-overhead')
+
+        # automatic mixed precision on CUDA devices
+        useAMP = ('cuda' in device)
+        scaler = torch.cuda.amp.GradScaler(enabled=useAMP)
+
+        progress = ProgressThrottler(updateStateFun, self._get_progress_interval())
         imgCount = 0
-        for (img, bboxes_target, labels_target, fVec, _) in tqdm(dataLoader):
-            img, bboxes_target, labels_target = img.to(device), \
-                                                bboxes_target.to(device), \
-                                                labels_target.to(device)
-
-            optimizer.zero_grad()
-            bboxes_pred, labels_pred = model(img)
-            loss_value = criterion(bboxes_pred, bboxes_target, labels_pred, labels_target)
-            loss_value.backward()
-            optimizer.step()
-
-            # check for Inf and NaN values and raise exception if needed
-            if any([
-                torch.any(torch.isinf(bboxes_pred)).item(),
-                torch.any(torch.isinf(labels_pred)).item(),
-                torch.any(torch.isnan(bboxes_pred)).item(),
-                torch.any(torch.isnan(labels_pred)).item()
-            ]):
+        for (img, bboxes_target, labels_target, fVec, _, corruptIDs) in tqdm(CudaPrefetcher(dataLoader, device)):
+            collator.set_corrupt(corruptIDs)    # in main process (collation may happen in worker processes)
+            optimizer.zero_grad(set_to_none=True)
+            with torch.cuda.amp.autocast(enabled=useAMP):
+                bboxes_pred, labels_pred = model_fwd(img)
+                loss_value = criterion(bboxes_pred, bboxes_target, labels_pred, labels_target)
+            scaler.scale(loss_value).backward()
+            scaler.step(optimizer)
+            scaler.update()
+
+            # check for Inf and NaN values and raise exception if needed (single device sync)
+            if not (torch.isfinite(bboxes_pred).all() & torch.isfinite(labels_pred).all()).item():
                 raise Exception('Model produced Inf and/or NaN values; training was aborted. Try reducing the learning rate.')
 
             # update worker state
             imgCount += img.size(0)
-            updateStateFun(state='PROGRESS', message='training', done=imgCount, total=len(dataLoader.dataset))
+            progress(state='PROGRESS', message='training', done=imgCount, total=len(dataLoader.dataset))
 
         # all done; return state dict as bytes
         return self.exportModelState(model)
@@ -458,8 +523,8 @@ class RetinaNet(GenericPyTorchModel):
         if stateDict is None:
             raise Exception('No trained model state found, but required for inference.')
 
-        # read state dict from bytes
-        model, labelclassMap = self.initializeModel(stateDict, data)
+        # read state dict from bytes (model is kept across inference chunks)
+        model, labelclassMap = self.initializeInferenceModel(stateDict, data)
 
         # initialize data loader, dataset, transforms
         inputSize = (int(optionsHelper.get_hierarchical_value(self.options, ['options', 'general', 'imageSize', 'width', 'value'])),
@@ -476,18 +541,37 @@ class RetinaNet(GenericPyTorchModel):
                                     transform=transform)
         dataEncoder = encoder.DataEncoder(minIoU_pos=0.5, maxIoU_neg=0.4)   # IoUs don't matter for inference
         collator = collation.Collator(self.project, self.dbConnector, (inputSize[1], inputSize[0],), dataEncoder)
+        device = self.get_device()
         dataLoader = DataLoader(
             dataset=dataset,
             collate_fn=collator.collate_fn,
-            shuffle=False
+            **self._get_dataloader_kwargs('inference', device)
         )
 
+        # affine transform from (xmin, ymin, xmax, ymax) to relative YOLO format (x, y, width, height)
+        toYOLO = torch.tensor([
+            [0.5, 0.0, -1.0, 0.0],
+            [0.0, 0.5, 0.0, -1.0],
+            [0.5, 0.0, 1.0, 0.0],
+            [0.0, 0.5, 0.0, 1.0]
+        ]) / torch.tensor([inputSize[0], inputSize[1], inputSize[0], inputSize[1]], dtype=torch.float32)
+
+        # decoding parameters and label class lookup
+        cls_thresh = optionsHelper.get_hierarchical_value(self.options, ['options', 'inference', 'encoding', 'cls_thresh', 'value'], fallback=0.1)
+        nms_thresh = optionsHelper.get_hierarchical_value(self.options, ['options', 'inference', 'encoding', 'nms_thresh', 'value'], fallback=0.1)
+        numPred_max = int(optionsHelper.get_hierarchical_value(self.options, ['options', 'inference', 'encoding', 'numPred_max', 'value'], fallback=128))
+        labelclassList_inv = dataset.labelclassList_inv
+
         # perform inference
         response = {}
-        device = self.get_device()
+        if 'cuda' in device:
+            torch.backends.cudnn.benchmark = True
         model.to(device)
+        model_fwd = self._compile_model(model, device)
+        progress = ProgressThrottler(updateStateFun, self._get_progress_interval())
         imgCount = 0
-        for (img, _, _, fVec, imgID) in tqdm(dataLoader):
+        for (img, _, _, fVec, imgID, corruptIDs) in tqdm(CudaPrefetcher(dataLoader, device, indices=(0,))):
+            collator.set_corrupt(corruptIDs)    # in main process (collation may happen in worker processes)
 
             # TODO: implement feature vectors
             # if img is not None:
@@ -496,59 +580,46 @@ class RetinaNet(GenericPyTorchModel):
             # else:
             #     dataItem = fVec.to(device)
             #     isFeatureVector = True
-            dataItem = img.to(device)
+            dataItem = img      # already on device (see CudaPrefetcher)
 
-            with torch.no_grad():
-                bboxes_pred_batch, labels_pred_batch = model(dataItem, False)   #TODO: isFeatureVector
-                bboxes_pred_batch, labels_pred_batch, confs_pred_batch = dataEncoder.decode(bboxes_pred_batch.squeeze(0).cpu(),
-                                    labels_pred_batch.squeeze(0).cpu(),
+            with torch.inference_mode():
+                bboxes_pred_batch, labels_pred_batch = model_fwd(dataItem, False)   #TODO: isFeatureVector
+                bboxes_pred_batch, labels_pred_batch, confs_pred_batch = dataEncoder.decode(bboxes_pred_batch,
+                                    labels_pred_batch,
                                     inputSize,
-                                    cls_thresh=optionsHelper.get_hierarchical_value(self.options, ['options', 'inference', 'encoding', 'cls_thresh', 'value'], fallback=0.1),
-                                    nms_thresh=optionsHelper.get_hierarchical_value(self.options, ['options', 'inference', 'encoding', 'nms_thresh', 'value'], fallback=0.1),
-                                    numPred_max=int(optionsHelper.get_hierarchical_value(self.options, ['options', 'inference', 'encoding', 'numPred_max', 'value'], fallback=128)),
+                                    cls_thresh=cls_thresh,
+                                    nms_thresh=nms_thresh,
+                                    numPred_max=numPred_max,
                                     return_conf=True)
 
                 for i in range(len(imgID)):
-                    bboxes_pred = bboxes_pred_batch[i]
-                    labels_pred = labels_pred_batch[i]
-                    confs_pred = confs_pred_batch[i]
-                    if bboxes_pred.dim() == 2:
-                        bboxes_pred = bboxes_pred.unsqueeze(0)
-                        labels_pred = labels_pred.unsqueeze(0)
-                        confs_pred = confs_pred.unsqueeze(0)
+                    bboxes_pred_img = bboxes_pred_batch[i]
+                    labels_pred_img = labels_pred_batch[i]
+                    confs_pred_img = confs_pred_batch[i]
 
                     # convert bounding boxes to YOLO format
                     predictions = []
-                    bboxes_pred_img = bboxes_pred[0,...]
-                    labels_pred_img = labels_pred[0,...]
-                    confs_pred_img = confs_pred[0,...]
                     if len(bboxes_pred_img):
-                        bboxes_pred_img[:,2] -= bboxes_pred_img[:,0]
-                        bboxes_pred_img[:,3] -= bboxes_pred_img[:,1]
-                        bboxes_pred_img[:,0] += bboxes_pred_img[:,2]/2
-                        bboxes_pred_img[:,1] += bboxes_pred_img[:,3]/2
-                        bboxes_pred_img[:,0] /= inputSize[0]
-                        bboxes_pred_img[:,1] /= inputSize[1]
-                        bboxes_pred_img[:,2] /= inputSize[0]
-                        bboxes_pred_img[:,3] /= inputSize[1]
-
-                        # limit to image bounds
-                        bboxes_pred_img = torch.clamp(bboxes_pred_img, 0, 1)
+                        # xyxy -> xywh (center), normalized by image size and limited to image bounds
+                        bboxes_pred_img = torch.clamp(torch.matmul(bboxes_pred_img, toYOLO.to(bboxes_pred_img)), 0, 1)
 
+                        # retrieve all values at once (avoids one device sync per box)
+                        bboxes_list = bboxes_pred_img.tolist()
+                        labels_list = [labelclassList_inv[l] for l in labels_pred_img.tolist()]
+                        logits_list = confs_pred_img.tolist()
+                        confs_list = confs_pred_img.max(dim=1)[0].tolist()
 
                         # append to dict
-                        for b in range(bboxes_pred_img.size(0)):
-                            bbox = bboxes_pred_img[b,:]
-                            label = labels_pred_img[b]
-                            logits = confs_pred_img[b,:]
+                        for b in range(len(bboxes_list)):
+                            bbox = bboxes_list[b]
                             predictions.append({
-                                'x': bbox[0].item(),
-                                'y': bbox[1].item(),
-                                'width': bbox[2].item(),
-                                'height': bbox[3].item(),
-                                'label': dataset.labelclassMap_inv[label.item()],
-                                'logits': logits.numpy().tolist(),        #TODO: for AL criterion?
-                                'confidence': torch.max(logits).item()
+                                'x': bbox[0],
+                                'y': bbox[1],
+                                'width': bbox[2],
+                                'height': bbox[3],
+                                'label': labels_list[b],
+                                'logits': logits_list[b],        #TODO: for AL criterion?
+                                'confidence': confs_list[b]
                             })
                     
                     response[imgID[i]] = {
@@ -558,7 +629,7 @@ class RetinaNet(GenericPyTorchModel):
 
             # update worker state
             imgCount += len(imgID)
-            updateStateFun(state='PROGRESS', message='predicting', done=imgCount, total=len(dataLoader.dataset))
+            progress(state='PROGRESS', message='predicting', done=imgCount, total=len(dataLoader.dataset))
 
         model.cpu()
         if 'cuda' in device:
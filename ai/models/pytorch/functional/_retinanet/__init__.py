@@ -438,6 +438,18 @@ DEFAULT_OPTIONS = {
 					"value": "Image.BILINEAR"
 				}
 			},
+			"compile_model": {
+				"name": "Compile model (PyTorch >= 2.0)",
+				"description": "If checked, the model is compiled with torch.compile for faster training and inference on CUDA devices.<br />Compilation takes time upon the first batch and falls back to the regular model if it fails.",
+				"value": False
+			},
+			"progress_interval": {
+				"name": "Progress update interval",
+				"description": "Minimum time (in seconds) between two progress reports during training and inference.",
+				"min": 0.0,
+				"max": 3600,
+				"value": 0.5
+			},
 			"labelClasses": {
 				"name": "New and removed label classes",
 				"add_missing": {
@@ -496,6 +508,22 @@ DEFAULT_OPTIONS = {
 					"min": 1,
 					"max": 8192,
 					"value": 1
+				},
+				"num_workers": {
+					"name": "Number of data loader workers",
+					"description": "Number of background processes that load and transform images. Zero = load images in the main process.",
+					"type": "int",
+					"min": 0,
+					"max": 64,
+					"value": 0
+				},
+				"prefetch_factor": {
+					"name": "Batches to prefetch per worker",
+					"description": "Only used if the number of workers is above zero. Values above 4 rarely help.",
+					"type": "int",
+					"min": 1,
+					"max": 4,
+					"value": 2
 				}
 			},
 			"optim": {
@@ -707,6 +735,22 @@ DEFAULT_OPTIONS = {
 					"min": 1,
 					"max": 8192,
 					"value": 1
+				},
+				"num_workers": {
+					"name": "Number of data loader workers",
+					"description": "Number of background processes that load and transform images. Zero = load images in the main process.",
+					"type": "int",
+					"min": 0,
+					"max": 64,
+					"value": 0
+				},
+				"prefetch_factor": {
+					"name": "Batches to prefetch per worker",
+					"description": "Only used if the number of workers is above zero. Values above 4 rarely help.",
+					"type": "int",
+					"min": 1,
+					"max": 4,
+					"value": 2
 				}
 			},
 			"transform": {
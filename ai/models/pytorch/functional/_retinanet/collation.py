@@ -4,7 +4,12 @@
     Args:
         batch: (list) of images, cls_targets, loc_targets.
     Returns:
-        padded images, stacked cls_targets, stacked loc_targets.
+        padded images, stacked cls_targets, stacked loc_targets, feature
+        vectors, image IDs, IDs of corrupt images.
+    Corrupt images are not flagged in the database here, since the collate
+    function may run in DataLoader worker processes, which must not use the
+    connection pool of the parent process. Instead, "set_corrupt" is to be
+    called with the returned IDs from the main process.
 
     2019-20 Benjamin Kellenberger
     Adapted from https://github.com/kuangliu/pytorch-retinanet/blob/master/datagen.py
@@ -22,16 +27,21 @@ class Collator():
         self.inputSize = inputSize
         self.encoder = encoder
 
+    def set_corrupt(self, imageIDs):
+        for imageID in imageIDs:
+            helpers.setImageCorrupt(self.dbConnector, self.project, imageID, True)
+
     def collate_fn(self, batch):
         imgs = []
         boxes = []
         labels = []
         fVecs = []
         imageIDs = []
+        corruptIDs = []
         for idx in range(len(batch)):
             if batch[idx][0] is None:
                 # corrupt image
-                helpers.setImageCorrupt(self.dbConnector, self.project, batch[idx][4], True)
+                corruptIDs.append(batch[idx][4])
             
             else:
                 imgs.append(batch[idx][0])
@@ -42,19 +52,15 @@ class Collator():
 
         h, w = self.inputSize
         num_imgs = len(imgs)
-        inputs = torch.zeros(num_imgs, 3, h, w)
+        inputs = torch.empty(num_imgs, 3, h, w)     # fully overwritten below; no need to zero-fill
 
         loc_targets = []
         cls_targets = []
-        fVecs_targets = []
-        imageIDs_targets = []
         for i in range(num_imgs):
             inputs[i] = imgs[i]
             loc_target, cls_target = self.encoder.encode(boxes[i], labels[i], input_size=(w,h))
             loc_targets.append(loc_target)
             cls_targets.append(cls_target)
-            fVecs_targets.append(fVecs[i])
-            imageIDs_targets.append(imageIDs[i])
 
         
-        return inputs, torch.stack(loc_targets), torch.stack(cls_targets), fVecs_targets, imageIDs_targets
\ No newline at end of file
+        return inputs, torch.stack(loc_targets), torch.stack(cls_targets), fVecs, imageIDs, corruptIDs
\ No newline at end of file
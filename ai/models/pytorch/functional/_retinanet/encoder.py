@@ -1,8 +1,9 @@
 '''Encode object boxes and labels.'''
 import math
 import torch
+from torchvision.ops import batched_nms
 
-from .utils import meshgrid, box_iou, box_nms, change_box_order
+from .utils import meshgrid, box_iou, change_box_order
 
 
 class DataEncoder:
@@ -13,6 +14,7 @@ class DataEncoder:
         self.aspect_ratios = [1/2., 1/1., 2/1.]
         self.scale_ratios = [1., pow(2,1/3.), pow(2,2/3.)]
         self.anchor_wh = self._get_anchor_wh()
+        self._anchor_boxes = {}
 
     def _get_anchor_wh(self):
         '''Compute anchor width and height for each feature map.
@@ -32,7 +34,29 @@ class DataEncoder:
         num_fms = len(self.anchor_areas)
         return torch.Tensor(anchor_wh).view(num_fms, -1, 2)
 
-    def _get_anchor_boxes(self, input_size):
+    def _get_anchor_boxes(self, input_size, device='cpu'):
+        '''Return (cached) anchor boxes for the given input size and device.
+
+        Anchors only depend on the input size, so they are computed once on
+        the CPU (used for target encoding) and copied at most once to every
+        other device (used for decoding).
+
+        Args:
+          input_size: (tensor) model input size of (w,h).
+          device: (str/torch.device) device to return the anchor boxes on.
+
+        Returns:
+          boxes: (tensor) anchor boxes, sized [#anchors,4]. Must not be modified in-place.
+        '''
+        key = (tuple(input_size.tolist()), str(device))
+        if key not in self._anchor_boxes:
+          cpuKey = (key[0], 'cpu')
+          if cpuKey not in self._anchor_boxes:
+            self._anchor_boxes[cpuKey] = self._build_anchor_boxes(input_size)
+          self._anchor_boxes[key] = self._anchor_boxes[cpuKey].to(device)
+        return self._anchor_boxes[key]
+
+    def _build_anchor_boxes(self, input_size):
         '''Compute anchor boxes for each feature map.
 
         Args:
@@ -122,18 +146,21 @@ class DataEncoder:
         '''Decode outputs back to bouding box locations and class labels.
 
         Args:
-          loc_preds: (tensor) predicted locations, sized [#anchors, 4].
-          cls_preds: (tensor) predicted class labels, sized [#anchors, #classes].
+          loc_preds: (tensor) predicted locations, sized [#images, #anchors, 4] or [#anchors, 4].
+          cls_preds: (tensor) predicted class labels, sized [#images, #anchors, #classes] or [#anchors, #classes].
           input_size: (int/tuple) model input size of (w,h).
 
         Returns:
-          boxes: (tensor) decode box locations, sized [#obj,4].
-          labels: (tensor) class labels for each box, sized [#obj,].
+          boxes: (list) decoded box locations per image, each sized [#obj,4].
+          labels: (list) class labels for each box per image, each sized [#obj,].
+          logits: (list) class confidences for each box per image, each sized [#obj,#classes]
+                  (only if return_conf is True).
+          Boxes are sorted by decreasing score and stay on the device of the inputs.
         '''
 
         input_size = torch.Tensor([input_size,input_size]) if isinstance(input_size, int) \
                      else torch.Tensor(input_size)
-        anchor_boxes = self._get_anchor_boxes(input_size)
+        anchor_boxes = self._get_anchor_boxes(input_size, loc_preds.device)
 
         if loc_preds.dim() == 2:
           loc_preds = loc_preds.unsqueeze(0)
@@ -154,34 +181,37 @@ class DataEncoder:
 
         logits = cls_preds.sigmoid()
         score, labels = logits.max(2)          # [#images,#anchors,]
-        ids = score > cls_thresh
-        
-        # limit number of predictions per image
-        if numPred_max is not None and numPred_max < len(ids):
-          order = torch.argsort(score[ids])
-          order = torch.flip(order, (0,))
-          ids = ids[order[0:numPred_max]]
-
-        ids = ids.nonzero().squeeze(1)             # [imgIdx,objIdx]
-
-        keep = []
-        for b in range(batch_size):
-          nextB = ids[:,0] == b
-          if nms_thresh > 0:
-            keepB = box_nms(boxes[ids[nextB,0],ids[nextB,1],:], score[ids[nextB,0],ids[nextB,1]], threshold=nms_thresh)
-          else:
-            keepB = torch.arange(ids[nextB,1].size(0))
-          keep.append(ids[nextB,1][keepB])
+        imgIdx, objIdx = (score > cls_thresh).nonzero(as_tuple=True)   # [#candidates,] each
+
+        # NMS (boxes are only compared within the same image); returned indices are
+        # sorted by decreasing score per image.
+        # Note: restricting comparisons to boxes of neighboring anchors (ASAP-NMS) is not
+        # faster than batched_nms, unless the neighborhood is too small to give the same results
+        if nms_thresh > 0:
+          # all images at once; torchvision computes areas without the +1 pixel
+          # term of box_iou, so the max. coordinates are shifted to match it
+          boxes_nms = boxes[imgIdx,objIdx,:]
+          boxes_nms = torch.cat([boxes_nms[:,:2], boxes_nms[:,2:]+1], 1)
+          keep = batched_nms(boxes_nms, score[imgIdx,objIdx], imgIdx, nms_thresh)
+        else:
+          keep = torch.argsort(score[imgIdx,objIdx], descending=True)
+        imgIdx, objIdx = imgIdx[keep], objIdx[keep]
 
         # assemble final annotations
         boxes_out = []
         labels_out = []
         logits_out = []
         for b in range(batch_size):
-          boxes_out.append(boxes[b,keep[b],:])
-          labels_out.append(labels[b,keep[b]])
+          keepB = objIdx[imgIdx == b]
+
+          # limit number of predictions per image
+          if numPred_max is not None:
+            keepB = keepB[:numPred_max]
+
+          boxes_out.append(boxes[b,keepB,:])
+          labels_out.append(labels[b,keepB])
           if return_conf:
-            logits_out.append(logits[b,keep[b],:])
+            logits_out.append(logits[b,keepB,:])
 
         if return_conf:
           return boxes_out, labels_out, logits_out
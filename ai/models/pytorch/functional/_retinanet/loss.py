@@ -12,7 +12,7 @@ class FocalLoss(nn.Module):
         self.gamma = gamma
         self.background_weight = background_weight
 
-    def focal_loss(self, x, y, num_classes):
+    def focal_loss(self, x, y, num_classes: int):
         '''Focal loss.
 
         Args:
@@ -79,9 +79,15 @@ class FocalLoss(nn.Module):
 
         loss:
           (tensor) loss = SmoothL1Loss(loc_preds, loc_targets) + FocalLoss(cls_preds, cls_targets).
+
+        Predictions are cast to float32 first, so that the loss (and its
+        summed reduction) are computed in full precision under autocast.
         '''
+        loc_preds = loc_preds.float()
+        cls_preds = cls_preds.float()
         pos = cls_targets > 0  # [N,#anchors]
         num_pos = pos.detach().long().sum()
+        loc_loss = torch.zeros((), device=loc_preds.device)   # defined in all branches (required by TorchScript)
 
         ################################################################
         # loc_loss = SmoothL1Loss(pos_loc_preds, pos_loc_targets)
@@ -0,0 +1,34 @@
+'''
+    Helper for compiled (torch.compile; PyTorch >= 2.0) model forward passes.
+    Compilation is lazy: torch.compile returns immediately and any failure
+    only surfaces upon the first forward call, which is therefore where the
+    fallback to eager mode has to happen.
+'''
+
+
+class CompiledForward:
+    '''
+        Calls the compiled module "compiled" instead of "model". If the first
+        call fails (e.g. due to an unsupported operation or a missing compiler
+        toolchain), a warning is printed and the original "model" is used from
+        then on.
+    '''
+    def __init__(self, model, compiled):
+        self.model = model
+        self.compiled = compiled
+        self._verified = False
+
+
+    def __call__(self, *args, **kwargs):
+        if self.compiled is None:
+            return self.model(*args, **kwargs)
+        if self._verified:
+            return self.compiled(*args, **kwargs)
+        try:
+            result = self.compiled(*args, **kwargs)
+            self._verified = True
+            return result
+        except Exception as e:
+            print(f'WARNING: could not compile model (message: "{str(e)}"); falling back to eager mode.')
+            self.compiled = None
+            return self.model(*args, **kwargs)
@@ -0,0 +1,67 @@
+'''
+    Wrapper around a PyTorch DataLoader that copies the next batch to the
+    target device on a dedicated CUDA stream while the current batch is still
+    being processed on the default stream.
+'''
+
+import torch
+
+
+class CudaPrefetcher:
+    '''
+        Iterates over the given "loader" and returns its batches with all
+        torch.Tensor entries moved to "device". If "indices" is given, only the
+        batch entries at these positions are moved and all others stay on the
+        host. Non-tensor entries (e.g. lists of image IDs) are passed on as-is.
+        On CUDA devices, the copy of batch n+1 is issued on a side stream
+        before batch n is returned, so that host-to-device transfers overlap
+        with the forward and backward passes. This requires the loader to use
+        pinned memory ("pin_memory=True") to be effective.
+        On other devices, batches are simply moved synchronously.
+    '''
+    def __init__(self, loader, device, indices=None):
+        self.loader = loader
+        self.device = device
+        self.indices = (None if indices is None else frozenset(indices))
+        self.stream = (torch.cuda.Stream() if 'cuda' in str(device) else None)
+
+
+    def __len__(self):
+        return len(self.loader)
+
+
+    def _moves(self, idx, b):
+        return isinstance(b, torch.Tensor) and (self.indices is None or idx in self.indices)
+
+
+    def _to_device(self, batch):
+        return [b.to(self.device, non_blocking=True) if self._moves(idx, b) else b for idx, b in enumerate(batch)]
+
+
+    def _preload(self, iterator):
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return None
+        with torch.cuda.stream(self.stream):
+            return self._to_device(batch)
+
+
+    def __iter__(self):
+        if self.stream is None:
+            for batch in self.loader:
+                yield self._to_device(batch)
+            return
+
+        iterator = iter(self.loader)
+        nextBatch = self._preload(iterator)
+        while nextBatch is not None:
+            currentStream = torch.cuda.current_stream()
+            currentStream.wait_stream(self.stream)
+            batch = nextBatch
+            for idx, b in enumerate(batch):
+                if self._moves(idx, b):
+                    # memory was allocated on the side stream; prevent premature reuse
+                    b.record_stream(currentStream)
+            nextBatch = self._preload(iterator)
+            yield batch
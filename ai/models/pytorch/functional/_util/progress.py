@@ -0,0 +1,28 @@
+'''
+    Helper to limit the rate at which model progress is reported to the
+    task queue. Every state update is a round-trip to the Celery result
+    backend, which becomes noticeable if issued for every batch.
+'''
+
+import time
+
+
+class ProgressThrottler:
+    '''
+        Wraps an "updateStateFun" (as provided to the models' "train" and
+        "inference" functions) and forwards calls at most once every "interval"
+        seconds. The first call, as well as calls where "done" reaches "total",
+        are always forwarded.
+    '''
+    def __init__(self, updateStateFun, interval=0.5):
+        self.updateStateFun = updateStateFun
+        self.interval = interval
+        self._last = None
+
+
+    def __call__(self, state, message, done=None, total=None):
+        now = time.monotonic()
+        isFinal = (done is not None and total is not None and done >= total)
+        if self._last is None or isFinal or now - self._last >= self.interval:
+            self._last = now
+            self.updateStateFun(state=state, message=message, done=done, total=total)
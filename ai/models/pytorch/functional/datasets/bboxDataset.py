@@ -10,6 +10,27 @@ from torch.utils.data import Dataset
 import numpy as np
 from PIL import Image
 
+try:
+    # optional: decode JPEGs with libjpeg-turbo directly
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _turboJPEG = TurboJPEG()
+except Exception:
+    _turboJPEG = None
+
+
+def _load_image(imageBytes):
+    '''
+        Decodes the given bytes into an RGB PIL image. JPEG files are de-
+        coded with libjpeg-turbo if PyTurboJPEG is installed; all other
+        formats (and failures thereof) fall back to PIL.
+    '''
+    if _turboJPEG is not None and imageBytes[:2] == b'\xff\xd8':
+        try:
+            return Image.fromarray(_turboJPEG.decode(imageBytes, pixel_format=TJPF_RGB))
+        except Exception:
+            pass
+    return Image.open(BytesIO(imageBytes)).convert('RGB')
+
 
 class BoundingBoxesDataset(Dataset):
     '''
@@ -49,35 +70,30 @@ class BoundingBoxesDataset(Dataset):
     
     def __parse_data(self, data):
         
-        # create inverse label class map as well
+        # create inverse label class map as well, plus a list version of it (index = position)
         self.labelclassMap_inv = {}
         for key in self.labelclassMap.keys():
             val = self.labelclassMap[key]
             self.labelclassMap_inv[val] = key
+        self.labelclassList_inv = [None] * (max(self.labelclassMap_inv.keys())+1 if len(self.labelclassMap_inv) else 0)
+        for val, key in self.labelclassMap_inv.items():
+            self.labelclassList_inv[val] = key
+        labelclassMap = self.labelclassMap
         
-        # parse images
+        # parse images; bounding boxes and labels of all images are stored in
+        # two contiguous arrays (struct of arrays), indexed per image by offsets
+        numAnno = sum([len(data['images'][key]['annotations']) for key in data['images'] if 'annotations' in data['images'][key]])
+        self.coords = np.empty((numAnno, 4), dtype=np.float64)     # cast to float32 after conversion
+        self.labels = np.empty(numAnno, dtype=np.int64)
+        self.offsets = np.empty(len(data['images'])+1, dtype=np.int64)
         self.data = []
+        count = 0
         hasUnknownClasses = False
-        for key in data['images']:
+        for idx, key in enumerate(data['images']):
             nextMeta = data['images'][key]
-            boundingBoxes = []
-            labels = []
+            self.offsets[idx] = count
             if 'annotations' in nextMeta:
                 for anno in nextMeta['annotations']:
-                    if self.targetFormat == 'xyxy':
-                        coords = (
-                            anno['x'] - anno['width']/2,
-                            anno['y'] - anno['height']/2,
-                            anno['x'] + anno['width']/2,
-                            anno['y'] + anno['height']/2
-                        )
-                    else:
-                        coords = (
-                            anno['x'],
-                            anno['y'],
-                            anno['width'],
-                            anno['height']
-                        )
                     label = anno['label']
                     unsure = (anno['unsure'] if 'unsure' in anno else False)
                     if unsure and self.ignoreUnsure:
@@ -86,18 +102,15 @@ class BoundingBoxesDataset(Dataset):
                         # this usually does not happen for bounding boxes, but we account for it nonetheless
                         continue
                     else:
-                        if label not in self.labelclassMap:
+                        if label not in labelclassMap:
                             # unknown class
                             hasUnknownClasses = True
                             continue
-                        label = self.labelclassMap[label]
-                    
-                    # sanity check
-                    if coords[2] <= 0 or coords[3] <= 0:
-                        continue
+                        label = labelclassMap[label]
 
-                    boundingBoxes.append(coords)
-                    labels.append(label)
+                    self.coords[count,:] = (anno['x'], anno['y'], anno['width'], anno['height'])
+                    self.labels[count] = label
+                    count += 1
 
             # feature vector
             #TODO
@@ -108,7 +121,22 @@ class BoundingBoxesDataset(Dataset):
             #     fVec = None
             
             imagePath = nextMeta['filename']
-            self.data.append((boundingBoxes, labels, key, fVec, imagePath))
+            self.data.append((key, fVec, imagePath))
+        self.offsets[-1] = count
+        coords = self.coords[:count,:]
+        labels = self.labels[:count]
+
+        # convert format for all annotations at once
+        if self.targetFormat == 'xyxy':
+            half = coords[:,2:4] * 0.5
+            coords[:,2:4] = coords[:,0:2] + half
+            coords[:,0:2] -= half
+
+        # sanity check; drop invalid boxes and shift image offsets accordingly
+        valid = (coords[:,2] > 0) & (coords[:,3] > 0)
+        self.offsets = np.concatenate(([0], np.cumsum(valid)))[self.offsets]
+        self.coords = coords[valid,:].astype(np.float32)
+        self.labels = labels[valid]
         
         if hasUnknownClasses:
             print('WARNING: encountered unknown label classes.')
@@ -119,28 +147,23 @@ class BoundingBoxesDataset(Dataset):
     
     def __getitem__(self, idx):
 
-        boundingBoxes, labels, imageID, fVec, imagePath = self.data[idx]
+        imageID, fVec, imagePath = self.data[idx]
+        start, end = self.offsets[idx], self.offsets[idx+1]
 
         # load image
         try:
-            img = Image.open(BytesIO(self.fileServer.getFile(imagePath))).convert('RGB')
+            img = _load_image(self.fileServer.getFile(imagePath))
         except:
             print('WARNING: Image {} is corrupt and could not be loaded.'.format(imagePath))
             img = None
 
-        labels = torch.tensor(labels).long()
+        labels = torch.from_numpy(self.labels[start:end].copy())     # copy: transforms must not modify the dataset
+        boundingBoxes = None
 
         if img is not None:
-            # convert data
+            # convert data (relative to absolute coordinates; creates a new array)
             sz = img.size
-            boundingBoxes = torch.tensor(boundingBoxes).clone()
-            if len(boundingBoxes):
-                if boundingBoxes.dim() == 1:
-                    boundingBoxes = boundingBoxes.unsqueeze(0)
-                boundingBoxes[:,0] *= sz[0]
-                boundingBoxes[:,1] *= sz[1]
-                boundingBoxes[:,2] *= sz[0]
-                boundingBoxes[:,3] *= sz[1]
+            boundingBoxes = torch.from_numpy(self.coords[start:end,:] * np.array([sz[0], sz[1], sz[0], sz[1]], dtype=np.float32))
 
             if self.transform is not None:
                 img, boundingBoxes, labels = self.transform(img, boundingBoxes, labels)
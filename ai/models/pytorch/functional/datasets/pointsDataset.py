@@ -109,6 +109,10 @@ class PointsDataset(Dataset):
             # else:
             #     fVec = None
             
+            # store as arrays to avoid conversion from Python lists for every sample
+            points = np.array(points, dtype=np.float32).reshape(-1, 2)
+            labels = np.array(labels, dtype=np.int64)
+
             imagePath = nextMeta['filename']
             self.data.append((points, labels, label_img, key, fVec, imagePath))
         
@@ -131,12 +135,9 @@ class PointsDataset(Dataset):
             img = None
 
         if img is not None:
-            points = torch.tensor(points).clone()
-            if len(points):
-                if points.dim() == 1:
-                    points = points.unsqueeze(0)
-                points *= torch.tensor(img.size, dtype=points.dtype)
-            labels = torch.tensor(labels).long()
+            # relative to absolute coordinates (creates a new array, so the dataset's copy stays untouched)
+            points = torch.from_numpy(points * np.array(img.size, dtype=np.float32))
+            labels = torch.from_numpy(labels.copy())
 
             if self.transform is not None:
                 img, points, labels = self.transform(img, points, labels)
@@ -64,7 +64,7 @@ class GenericPyTorchModel(AIModel):
             device = 'cpu'
         return device
 
-    
+
     def initializeModel(self, stateDict, data, addMissingLabelClasses=False, removeObsoleteLabelClasses=False):
         '''
             Converts the provided stateDict from a bytes array to a torch-loadable
@@ -80,6 +80,9 @@ class GenericPyTorchModel(AIModel):
             label classes that are not present in the set of label classes anymore are
             removed, and the map is also updated.
         '''
+        # release model kept for inference (see "initializeInferenceModel")
+        self._inferenceModel = None
+
         # initialize model
         if stateDict is not None:
             stateDict = torch.load(io.BytesIO(stateDict), map_location=lambda storage, loc: storage)
@@ -113,6 +116,25 @@ class GenericPyTorchModel(AIModel):
         return model, labelclassMap
 
 
+    def initializeInferenceModel(self, stateDict, data):
+        '''
+            Like "initializeModel", but keeps the model for the most recently
+            provided stateDict object. Repeated inference calls with the same
+            state (e.g. once per inference chunk of the AIWorker) thus neither
+            decode the state nor build the model again.
+            Returns a copy of the labelclassMap, so that callers cannot modify
+            the kept one.
+            Only to be used for inference; calling "initializeModel" (e.g. for
+            training) releases the kept model.
+        '''
+        cached = getattr(self, '_inferenceModel', None)
+        if cached is None or cached[0] is not stateDict:
+            model, labelclassMap = self.initializeModel(stateDict, data)
+            cached = (stateDict, model, labelclassMap)
+            self._inferenceModel = cached
+        return cached[1], dict(cached[2])
+
+
     @staticmethod
     def parseTransforms(transforms):
         '''
@@ -71,7 +71,7 @@ app.conf.update(
     broker_heartbeat = 0,                   # required to avoid peer connection resets
     worker_max_tasks_per_child = 1,         # required to free memory (also CUDA) after each process
     # task_default_rate_limit = 3,            #TODO
-    worker_prefetch_multiplier = 1,         #TODO
+    worker_prefetch_multiplier = 1,         # long-running AI tasks: do not reserve tasks for busy processes
     task_acks_late = True,
     task_create_missing_queues = True,
     task_queues = tuple(queues),
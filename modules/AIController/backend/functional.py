@@ -7,6 +7,7 @@
 '''
 
 from collections.abc import Iterable
+import math
 import json
 from uuid import UUID
 from datetime import datetime
@@ -141,7 +142,7 @@ class AIControllerWorker:
 
         if numChunks > 1:
             # split for distribution across workers (TODO: also specify subset size for multiple jobs; randomly draw if needed)
-            imageIDs = array_split(imageIDs, max(1, len(imageIDs) // numChunks))
+            imageIDs = array_split(imageIDs, max(1, math.ceil(len(imageIDs) / numChunks)))
         else:
             imageIDs = [imageIDs]
 
@@ -170,7 +171,7 @@ class AIControllerWorker:
             imageIDs = [i['image'] for i in imageIDs]
             
             if numChunks > 1:
-                imageIDs = array_split(imageIDs, max(1, len(imageIDs) // numChunks))
+                imageIDs = array_split(imageIDs, max(1, math.ceil(len(imageIDs) / numChunks)))
             else:
                 imageIDs = [imageIDs]
             return imageIDs
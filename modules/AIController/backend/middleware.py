@@ -6,6 +6,7 @@
 
 from collections.abc import Iterable
 from datetime import datetime
+import math
 import uuid
 import re
 import json
@@ -428,7 +429,7 @@ class AIMiddleware():
 
         if maxNumWorkers > 1:
             # split for distribution across workers (TODO: also specify subset size for multiple jobs; randomly draw if needed)
-            imageIDs = array_split(imageIDs, max(1, len(imageIDs) // num_workers))
+            imageIDs = array_split(imageIDs, max(1, math.ceil(len(imageIDs) / max(1, num_workers))))
         else:
             imageIDs = [imageIDs]
 
@@ -465,7 +466,7 @@ class AIMiddleware():
                 maxNumWorkers = min(maxNumWorkers, num_available)
         
         if maxNumWorkers > 1:
-            imageIDs = array_split(imageIDs, max(1, len(imageIDs) // maxNumWorkers))
+            imageIDs = array_split(imageIDs, max(1, math.ceil(len(imageIDs) / maxNumWorkers)))
         else:
             imageIDs = [imageIDs]
         return imageIDs
@@ -140,12 +140,13 @@ class AIWorker():
     def _get_model_instance(self, project, overrideModelSettings=None):
         '''
             Returns the class instance of the model specified in the given
-            project.
+            project, together with the model library, the inference chunk
+            size and the project's annotation type.
             TODO: cache models?
         '''
         # get model settings for project
         queryStr = '''
-            SELECT ai_model_library, ai_model_settings, inference_chunk_size FROM aide_admin.project
+            SELECT ai_model_library, ai_model_settings, inference_chunk_size, annotationType FROM aide_admin.project
             WHERE shortname = %s;
         '''
         result = self.dbConnector.execute(queryStr, (project,), 1)
@@ -163,7 +164,7 @@ class AIWorker():
         elif chunkSizeLimit > 0:
             inferenceChunkSize = min(inferenceChunkSize, chunkSizeLimit)
 
-        return modelInstance, modelLibrary, inferenceChunkSize
+        return modelInstance, modelLibrary, inferenceChunkSize, result[0]['annotationtype']
 
 
     def _get_alCriterion_instance(self, project, overrideModelSettings=None):
@@ -202,7 +203,7 @@ class AIWorker():
     def call_update_model(self, numEpochs, project, aiModelSettings=None):
 
         # get project-specific model
-        modelInstance, modelLibrary, _ = self._get_model_instance(project, aiModelSettings)
+        modelInstance, modelLibrary, _, _ = self._get_model_instance(project, aiModelSettings)
 
         return functional._call_update_model(project, numEpochs, modelInstance, modelLibrary,
                 self.dbConnector)
@@ -211,17 +212,17 @@ class AIWorker():
     def call_train(self, data, epoch, numEpochs, project, subset, aiModelSettings=None):
 
         # get project-specific model
-        modelInstance, modelLibrary, _ = self._get_model_instance(project, aiModelSettings)
+        modelInstance, modelLibrary, _, annoType = self._get_model_instance(project, aiModelSettings)
 
         return functional._call_train(project, data, epoch, numEpochs, subset, modelInstance, modelLibrary,
-                self.dbConnector)
+                self.dbConnector, annoType)
     
 
 
     def call_average_model_states(self, epoch, numEpochs, project, aiModelSettings=None):
 
         # get project-specific model
-        modelInstance, modelLibrary, _ = self._get_model_instance(project, aiModelSettings)
+        modelInstance, modelLibrary, _, _ = self._get_model_instance(project, aiModelSettings)
         
         return functional._call_average_model_states(project, epoch, numEpochs, modelInstance, modelLibrary,
                 self.dbConnector)
@@ -231,7 +232,7 @@ class AIWorker():
     def call_inference(self, imageIDs, epoch, numEpochs, project, aiModelSettings=None, alCriterionSettings=None):
         
         # get project-specific model and AL criterion
-        modelInstance, modelLibrary, inferenceChunkSize = self._get_model_instance(project, aiModelSettings)
+        modelInstance, modelLibrary, inferenceChunkSize, _ = self._get_model_instance(project, aiModelSettings)
         alCriterionInstance = self._get_alCriterion_instance(project, alCriterionSettings)
 
         return functional._call_inference(project, imageIDs, epoch, numEpochs,
@@ -22,37 +22,71 @@
     2019-21 Benjamin Kellenberger
 '''
 
+import time
+import math
 import base64
 import json
+from functools import lru_cache
 import numpy as np
 from celery import current_task, states
 import psycopg2
 from psycopg2 import sql
-from util.helpers import array_split
 from constants.dbFieldNames import FieldNames_annotation, FieldNames_prediction
 
 
 
-def __get_message_fun(project, cumulatedTotal=None, offset=0, epoch=None, numEpochs=None):
-    def __on_message(state, message, done=None, total=None):
+class _MessageFun:
+    '''
+        Callable that forwards status updates of the AI model functions to
+        the current Celery task. Progress values ("done", "total") are
+        shifted by "offset" (for chunked processing) and limited by
+        "cumulatedTotal".
+        Intermediate "PROGRESS" updates are forwarded at most once every
+        "minInterval" seconds, as each update is a round-trip to the result
+        backend; other states, messages without progress values and completed
+        progress (done >= total) are always forwarded.
+    '''
+    __slots__ = ('project', 'cumulatedTotal', 'offset', 'epoch', 'minInterval',
+                '_prefix', '_hasCumulatedTotal', '_lastProgress')
+
+    def __init__(self, project, cumulatedTotal=None, offset=0, epoch=None, numEpochs=None, minInterval=0.1):
+        self.project = project
+        self.cumulatedTotal = cumulatedTotal
+        self.offset = offset
+        self.epoch = epoch
+        self.minInterval = minInterval
+        self._hasCumulatedTotal = isinstance(cumulatedTotal, int) or isinstance(cumulatedTotal, float)
+        if isinstance(epoch, int) and isinstance(numEpochs, int) and numEpochs > 1:
+            self._prefix = f'[Epoch {epoch}/{numEpochs}] '
+        else:
+            self._prefix = ''
+        self._lastProgress = None
+
+
+    def __call__(self, state, message, done=None, total=None):
+        if state == 'PROGRESS' and done is not None and total is not None and done < total:
+            now = time.monotonic()
+            if self._lastProgress is not None and now - self._lastProgress < self.minInterval:
+                return
+            self._lastProgress = now
+
         meta = {
-            'project': project,
-            'epoch': epoch
+            'project': self.project,
+            'epoch': self.epoch
         }
-        if (isinstance(done, int) or isinstance(done, float)) and \
-            (isinstance(total, int) or isinstance(total, float)):
-            trueTotal = total + offset
-            if isinstance(cumulatedTotal, int) or isinstance(cumulatedTotal, float):
-                trueTotal = max(trueTotal, cumulatedTotal)
-            meta['done'] = min(done + offset, trueTotal)
+        hasProgress = (isinstance(done, int) or isinstance(done, float)) and \
+            (isinstance(total, int) or isinstance(total, float))
+        if hasProgress:
+            trueTotal = total + self.offset
+            if self._hasCumulatedTotal:
+                trueTotal = max(trueTotal, self.cumulatedTotal)
+            meta['done'] = min(done + self.offset, trueTotal)
             meta['total'] = max(meta['done'], trueTotal)    #max(done, trueTotal)
 
-        message_combined = ''
-        if isinstance(epoch, int) and isinstance(numEpochs, int) and numEpochs > 1:
-            message_combined += f'[Epoch {epoch}/{numEpochs}] '
-
         if isinstance(message, str):
-            message_combined += message
+            message_combined = self._prefix + message
+        else:
+            message_combined = self._prefix
         
         if len(message_combined):
             meta['message'] = message_combined
@@ -60,7 +94,10 @@ def __get_message_fun(project, cumulatedTotal=None, offset=0, epoch=None, numEpo
             state=state,
             meta=meta
         )
-    return __on_message
+
+
+def __get_message_fun(project, cumulatedTotal=None, offset=0, epoch=None, numEpochs=None):
+    return _MessageFun(project, cumulatedTotal, offset, epoch, numEpochs)
 
 
 def __load_model_state(project, modelLibrary, dbConnector):
@@ -93,16 +130,9 @@ def __load_model_state(project, modelLibrary, dbConnector):
 
 
 
-def __load_metadata(project, dbConnector, imageIDs, loadAnnotations, modelOriginID):
-
-    # prepare
-    meta = {}
-    if imageIDs is None:
-        imageIDs = []
-
-    # label names and model-to-project mapping (if present)
-    labels = {}
-    queryStr = sql.SQL('''
+@lru_cache(maxsize=128)
+def __sql_load_labelclasses(project):
+    return sql.SQL('''
         SELECT * FROM {id_lc} AS lc
         LEFT OUTER JOIN (
             SELECT * FROM {id_lcmap}
@@ -113,67 +143,219 @@ def __load_metadata(project, dbConnector, imageIDs, loadAnnotations, modelOrigin
         id_lc=sql.Identifier(project, 'labelclass'),
         id_lcmap=sql.Identifier(project, 'model_labelclass')
     )
+
+
+@lru_cache(maxsize=128)
+def __sql_load_images(project):
+    return sql.SQL(
+        'SELECT * FROM {} WHERE id IN %s').format(sql.Identifier(project, 'image'))
+
+
+@lru_cache(maxsize=128)
+def __sql_load_images_annotations(project, annoType):
+    '''
+        Returns the query for images and their annotations, together with the
+        annotation keys and the (prefixed) column aliases they are returned
+        under. Annotation columns are prefixed to keep them apart from the
+        image columns.
+    '''
+    fieldNames = ['image'] + list(getattr(FieldNames_annotation, annoType).value)
+    keys = tuple(['annotationid'] + fieldNames)
+    aliases = tuple(['_anno_' + key for key in keys])
+    queryStr = sql.SQL('''
+        SELECT img.*, anno.id AS {id_alias}, {fieldNames} FROM {id_img} AS img
+        LEFT OUTER JOIN {id_anno} AS anno
+        ON img.id = anno.image
+        WHERE img.id IN %s;
+    ''').format(
+        id_alias=sql.Identifier(aliases[0]),
+        fieldNames=sql.SQL(', ').join([
+            sql.SQL('anno.{} AS {}').format(sql.SQL(f), sql.Identifier(a)) for f, a in zip(fieldNames, aliases[1:])
+        ]),
+        id_img=sql.Identifier(project, 'image'),
+        id_anno=sql.Identifier(project, 'annotation'))
+    return queryStr, keys, aliases
+
+
+
+def __load_metadata(project, dbConnector, imageIDs, loadAnnotations, modelOriginID, annoType=None):
+
+    # prepare
+    meta = {}
+    if imageIDs is None:
+        imageIDs = []
+
+    # label names and model-to-project mapping (if present)
+    labels = {}
+    queryStr = __sql_load_labelclasses(project)
     result = dbConnector.execute(queryStr, (modelOriginID,), 'all')
     if result is not None and len(result):
         for r in result:
             labels[r['id']] = r
     meta['labelClasses'] = labels
 
-    # image data
+    # image data and annotations
     imageMeta = {}
-    if len(imageIDs):
-        queryStr = sql.SQL(
-            'SELECT * FROM {} WHERE id IN %s').format(sql.Identifier(project, 'image'))
+    if len(imageIDs) and not loadAnnotations:
+        queryStr = __sql_load_images(project)
         result = dbConnector.execute(queryStr, (tuple(imageIDs),), 'all')
         if len(result):
             for r in result:
                 imageMeta[r['id']] = r
 
-    # annotations
-    if loadAnnotations and len(imageIDs):
-        # get project's annotation type
-        result = dbConnector.execute(sql.SQL('''
-                SELECT annotationType
-                FROM aide_admin.project
-                WHERE shortname = %s;
-            '''),
-            (project,),
-            1)
-        annoType = result[0]['annotationtype']
+    elif len(imageIDs):
+        if annoType is None:
+            # get project's annotation type
+            annoType = __get_project_meta(project, dbConnector)['annotationtype']
 
-        fieldNames = list(getattr(FieldNames_annotation, annoType).value)
-        queryStr = sql.SQL('''
-            SELECT id AS annotationID, image, {fieldNames} FROM {id_anno} AS anno
-            WHERE image IN %s;
-        ''').format(
-            fieldNames=sql.SQL(', ').join([sql.SQL(f) for f in fieldNames]),
-            id_anno=sql.Identifier(project, 'annotation'))
+        # load images and their annotations in one go
+        queryStr, keys, aliases = __sql_load_images_annotations(project, annoType)
         result = dbConnector.execute(queryStr, (tuple(imageIDs),), 'all')
         if len(result):
             for r in result:
-                if not 'annotations' in imageMeta[r['image']]:
-                    imageMeta[r['image']]['annotations'] = []
-                imageMeta[r['image']]['annotations'].append(r)
+                imgID = r['id']
+                if imgID not in imageMeta:
+                    imageMeta[imgID] = dict((key, value) for key, value in r.items() if not key.startswith('_anno_'))
+                if r['_anno_annotationid'] is not None:
+                    imageMeta[imgID].setdefault('annotations', []).append(dict(zip(keys, (r[a] for a in aliases))))
     meta['images'] = imageMeta
 
     return meta
 
 
+# per-process cache of project properties that only change upon project
+# reconfiguration; entries expire after _PROJECT_META_TTL seconds.
+# Note that worker processes are replaced after every task
+# (worker_max_tasks_per_child=1 in celery_worker.py), so the cache only saves
+# repeated lookups within a single task
+_PROJECT_META_TTL = 300
+_projectMeta = {}
+
+
+def __get_project_meta(project, dbConnector):
+    entry = _projectMeta.get(project, None)
+    now = time.monotonic()
+    if entry is None or now - entry[0] > _PROJECT_META_TTL:
+        result = dbConnector.execute(sql.SQL('''
+                SELECT annotationType, predictionType, ai_model_library, ai_alcriterion_library
+                FROM aide_admin.project
+                WHERE shortname = %s;
+            '''),
+            (project,),
+            1)
+        entry = (now, result[0])
+        _projectMeta[project] = entry
+    return entry[1]
+
+
 def __get_ai_library_names(project, dbConnector):
     model_library, alcriterion_library = None, None
     try:
-        queryStr = sql.SQL('''
-            SELECT ai_model_library, ai_alcriterion_library
-            FROM "aide_admin".project
-            WHERE shortname = %s;
-        ''')
-        result = dbConnector.execute(queryStr, (project,), 1)
-        model_library = result[0]['ai_model_library']
-        alcriterion_library = result[0]['ai_alcriterion_library']
+        projectMeta = __get_project_meta(project, dbConnector)
+        model_library = projectMeta['ai_model_library']
+        alcriterion_library = projectMeta['ai_alcriterion_library']
     finally:
         return model_library, alcriterion_library
 
 
+def __average_if_array(value):
+    if isinstance(value, list) or isinstance(value, np.ndarray):
+        # segmentation masks, etc.: array of values provided; take average instead
+        try:
+            value = np.nanmean(np.array(value))
+        except:
+            value = None
+    return value
+
+
+def __get_priority(prediction, imgID, segMask, segMaskDimensions):
+    value = None
+    if 'priority' in prediction and prediction['priority'] is None and 'confidence' in prediction:
+        # ranker somehow didn't assign value; use confidence by default
+        value = prediction['confidence']
+    elif 'priority' in prediction:
+        value = prediction['priority']
+    #TODO: provide replacement for priority, e.g. in case of segmentation masks
+    return __average_if_array(value)
+
+
+def __get_prediction_field_getters(fieldNames, predType, stateDictID):
+    '''
+        Resolves each field name of the prediction table to a function
+        "getter(prediction, imgID, segMask, segMaskDimensions)" that returns
+        the value to be inserted. This way, the field name dispatch is done
+        once per chunk instead of once per field and prediction.
+    '''
+    getters = []
+    for fn in fieldNames:
+        if fn == 'image':
+            getter = lambda prediction, imgID, segMask, segMaskDimensions: imgID
+        elif fn == 'cnnstate':
+            getter = lambda prediction, imgID, segMask, segMaskDimensions: stateDictID
+        elif fn == 'segmentationmask':
+            getter = lambda prediction, imgID, segMask, segMaskDimensions: segMask
+        elif (fn == 'width' or fn == 'height') and predType == 'segmentationMasks':
+            getter = lambda prediction, imgID, segMask, segMaskDimensions, fn=fn: segMaskDimensions[fn]
+        elif fn == 'priority':
+            getter = __get_priority
+        elif fn == 'confidence':
+            getter = lambda prediction, imgID, segMask, segMaskDimensions: __average_if_array(prediction.get('confidence', None))
+        else:
+            # field name might not be in return value; might need to raise a warning, Exception, or set to None
+            #TODO: might need to do typecasts (e.g. UUID?)
+            getter = lambda prediction, imgID, segMask, segMaskDimensions, fn=fn: prediction.get(fn, None)
+        getters.append(getter)
+    return getters
+
+
+@lru_cache(maxsize=128)
+def __sql_delete_predictions(project):
+    return sql.SQL('''
+        DELETE FROM {id_pred}
+        WHERE cnnstate = %s
+        AND image IN %s;
+    ''').format(id_pred=sql.Identifier(project, 'prediction'))
+
+
+@lru_cache(maxsize=128)
+def __sql_insert_predictions(project, fieldNames):
+    return sql.SQL('''
+        INSERT INTO {id_pred} ( {fieldNames} )
+        VALUES %s;
+    ''').format(
+        id_pred=sql.Identifier(project, 'prediction'),
+        fieldNames=sql.SQL(',').join([sql.SQL(f) for f in fieldNames]))
+
+
+@lru_cache(maxsize=128)
+def __sql_upsert_feature_vectors(project):
+    return sql.SQL('''
+        INSERT INTO {} ( id, fVec )
+        VALUES %s
+        ON CONFLICT (id) DO UPDATE SET fVec = EXCLUDED.fVec;
+    ''').format(sql.Identifier(project, 'image'))
+
+
+
+def __dump_stats(stats):
+    '''
+        Serializes model statistics for the "stats" (VARCHAR) column of the
+        model states table. Uses compact separators and converts values that
+        are not JSON-native (e.g. NumPy or torch scalars and arrays) instead
+        of failing.
+    '''
+    def _default(value):
+        if hasattr(value, 'tolist'):
+            # scalars become Python numbers, arrays (nested) lists
+            try:
+                return value.tolist()
+            except Exception:
+                pass
+        return str(value)
+    return json.dumps(stats, separators=(',', ':'), default=_default)
+
+
+
 def _call_update_model(project, numEpochs, modelInstance, modelLibrary, dbConnector):
     '''
         Checks first if any label classes have been added since the last model update.
@@ -233,11 +415,12 @@ def _call_update_model(project, numEpochs, modelInstance, modelLibrary, dbConnec
     try:
         update_state(state='FINALIZING', message=f'[{project} - model update] saving model state')
         model_library, alcriterion_library = __get_ai_library_names(project, dbConnector)
+        # binary COPY: sends the state dict as raw bytes instead of a hex-escaped literal
         queryStr = sql.SQL('''
-            INSERT INTO {} (stateDict, partial, model_library, alcriterion_library, marketplace_origin_id, labelclass_autoupdate)
-            VALUES( %s, %s, %s, %s, %s, TRUE )
+            COPY {} (stateDict, partial, model_library, alcriterion_library, marketplace_origin_id, labelclass_autoupdate)
+            FROM STDIN WITH (FORMAT binary)
         ''').format(sql.Identifier(project, 'cnnstate'))
-        dbConnector.execute(queryStr, (psycopg2.Binary(stateDict), False, model_library, alcriterion_library, modelOriginID), numReturn=None)
+        dbConnector.copy_binary(queryStr, [(stateDict, False, model_library, alcriterion_library, modelOriginID, True)])
     except Exception as e:
         print(e)
         raise Exception(f'[{project} - model update] error during data committing (reason: {str(e)})')
@@ -247,7 +430,7 @@ def _call_update_model(project, numEpochs, modelInstance, modelLibrary, dbConnec
 
 
 
-def _call_train(project, imageIDs, epoch, numEpochs, subset, modelInstance, modelLibrary, dbConnector):
+def _call_train(project, imageIDs, epoch, numEpochs, subset, modelInstance, modelLibrary, dbConnector, annoType=None):
     '''
         Initiates model training and maintains workers, status and failure
         events.
@@ -255,6 +438,7 @@ def _call_train(project, imageIDs, epoch, numEpochs, subset, modelInstance, mode
         Inputs:
         - imageIDs: a list of image UUIDs the model should be trained on. Note that the remaining
                     metadata (labels, class definitions, etc.) will be loaded here.
+        - annoType: the project's annotation type (optional; queried from the database if None)
         
         Function then performs sanity checks and forwards the data to the AI model's anonymous
         'train' function, together with some helper instances (a 'Database' instance as well as a
@@ -281,7 +465,7 @@ def _call_train(project, imageIDs, epoch, numEpochs, subset, modelInstance, mode
     # load labels and other metadata
     update_state(state='PREPARING', message=f'[Epoch {epoch}] loading metadata')
     try:
-        data = __load_metadata(project, dbConnector, imageIDs, True, modelOriginID)
+        data = __load_metadata(project, dbConnector, imageIDs, True, modelOriginID, annoType)
     except Exception as e:
         print(e)
         raise Exception(f'[Epoch {epoch}] error during metadata loading (reason: {str(e)})')
@@ -299,7 +483,7 @@ def _call_train(project, imageIDs, epoch, numEpochs, subset, modelInstance, mode
         stateDict = result[0]
         stats = result[1]
         if isinstance(stats, dict):
-            stats = json.dumps(stats)
+            stats = __dump_stats(stats)
         else:
             stats = None
     else:
@@ -310,11 +494,12 @@ def _call_train(project, imageIDs, epoch, numEpochs, subset, modelInstance, mode
     try:
         update_state(state='FINALIZING', message=f'[Epoch {epoch}] saving model state')
         model_library, alcriterion_library = __get_ai_library_names(project, dbConnector)
+        # binary COPY: sends the state dict as raw bytes instead of a hex-escaped literal
         queryStr = sql.SQL('''
-            INSERT INTO {} (stateDict, stats, partial, model_library, alcriterion_library, marketplace_origin_id, labelclass_autoupdate)
-            VALUES( %s, %s, %s, %s, %s, %s, %s )
+            COPY {} (stateDict, stats, partial, model_library, alcriterion_library, marketplace_origin_id, labelclass_autoupdate)
+            FROM STDIN WITH (FORMAT binary)
         ''').format(sql.Identifier(project, 'cnnstate'))
-        dbConnector.execute(queryStr, (psycopg2.Binary(stateDict), stats, subset, model_library, alcriterion_library, modelOriginID, labelclass_autoupdate), numReturn=None)
+        dbConnector.copy_binary(queryStr, [(stateDict, stats, bool(subset), model_library, alcriterion_library, modelOriginID, bool(labelclass_autoupdate))])
     except Exception as e:
         print(e)
         raise Exception(f'[Epoch {epoch}] error during data committing (reason: {str(e)})')
@@ -334,13 +519,13 @@ def _call_average_model_states(project, epoch, numEpochs, modelInstance, modelLi
     '''
 
     print(f'[{project}] Epoch {epoch}: Initiated model state averaging...')
-    update_state = update_state = __get_message_fun(project, None, 0, epoch, numEpochs)
+    update_state = __get_message_fun(project, None, 0, epoch, numEpochs)
 
     # get all model states
     update_state(state='PREPARING', message=f'[Epoch {epoch}] loading model states')
     try:
         queryStr = sql.SQL('''
-            SELECT stateDict, statistics, model_library, alcriterion_library, marketplace_origin_id
+            SELECT id, stateDict, stats, model_library, alcriterion_library, marketplace_origin_id
             FROM {}
             WHERE partial IS TRUE AND model_library = %s;
         ''').format(sql.Identifier(project, 'cnnstate'))
@@ -359,19 +544,28 @@ def _call_average_model_states(project, epoch, numEpochs, modelInstance, modelLi
     update_state(state='PREPARING', message=f'[Epoch {epoch}] averaging models')
     try:
         modelOriginID = queryResult[0]['marketplace_origin_id']
-        modelStates = [qr['statedict'] for qr in queryResult]
+        # detach state dicts from the query result, so that the model can
+        # release each serialized state once it has been deserialized
+        modelStates = [qr.pop('statedict') for qr in queryResult]
         modelStates_avg = modelInstance.average_model_states(stateDicts=modelStates, updateStateFun=update_state)
     except Exception as e:
         print(e)
         raise Exception(f'[Epoch {epoch}] error during model state fusion (reason: {str(e)})')
     
     # average statistics values (if present)
-    stats_avg = {}
-    dicts = [json.loads(qr['stats']) for qr in queryResult if qr['stats'] is not None]
-    keys = [list(d.keys()) for d in dicts]
-    keys = set([key for stats in keys for key in stats])
-    for key in keys:
-        stats_avg[key] = np.nanmean([d[key] for d in dicts if key in d])
+    # single pass over all states; NaN, missing and non-numeric values are ignored
+    stats_sum, stats_count = {}, {}
+    for qr in queryResult:
+        if qr['stats'] is None:
+            continue
+        for key, value in json.loads(qr['stats']).items():
+            if key not in stats_sum:
+                stats_sum[key], stats_count[key] = 0.0, 0
+            if not isinstance(value, (int, float)) or math.isnan(value):
+                continue
+            stats_sum[key] += value
+            stats_count[key] += 1
+    stats_avg = dict((key, stats_sum[key] / stats_count[key] if stats_count[key] else float('nan')) for key in stats_sum)
     if not len(stats_avg):
         stats_avg = None
 
@@ -383,27 +577,30 @@ def _call_average_model_states(project, epoch, numEpochs, modelInstance, modelLi
     except:
         # load model library from database
         model_library, alcriterion_library = __get_ai_library_names(project, dbConnector)
+    if stats_avg is not None:
+        stats_avg = __dump_stats(stats_avg)
     try:
+        # insert averaged state and delete partial model states in one statement (i.e., one
+        # round-trip and transaction). Only the states averaged here are removed (plus stale
+        # ones of other model libraries); partial states committed by other workers in the
+        # meantime are kept for the next averaging. The DELETE does not see the inserted row
+        # (same snapshot), and failures are raised so that the task does not report success
         queryStr = sql.SQL('''
-            INSERT INTO {} (stateDict, stats, partial, model_library, alcriterion_library, marketplace_origin_id)
-            VALUES ( %s )
-        ''').format(sql.Identifier(project, 'cnnstate'))
-        dbConnector.insert(queryStr, (modelStates_avg, stats_avg, False, model_library, alcriterion_library, modelOriginID))
+            WITH ins AS (
+                INSERT INTO {id_cnnstate} (stateDict, stats, partial, model_library, alcriterion_library, marketplace_origin_id)
+                VALUES ( %s, %s, %s, %s, %s, %s )
+                RETURNING id
+            )
+            DELETE FROM {id_cnnstate}
+            WHERE partial IS TRUE
+            AND (id IN %s OR model_library IS DISTINCT FROM %s);
+        ''').format(id_cnnstate=sql.Identifier(project, 'cnnstate'))
+        dbConnector.execute_checked(queryStr, (psycopg2.Binary(modelStates_avg), stats_avg, False, model_library, alcriterion_library, modelOriginID,
+                            tuple(qr['id'] for qr in queryResult), modelLibrary), numReturn=None)
     except Exception as e:
         print(e)
         raise Exception(f'[Epoch {epoch}] error during data committing (reason: {str(e)})')
 
-    # delete partial model states
-    update_state(state='FINALIZING', message=f'[Epoch {epoch}] purging cache')
-    try:
-        queryStr = sql.SQL('''
-            DELETE FROM {} WHERE partial IS TRUE;
-        ''').format(sql.Identifier(project, 'cnnstate'))
-        dbConnector.execute(queryStr, None, None)
-    except Exception as e:
-        print(e)
-        raise Exception(f'[Epoch {epoch}] error during cache purging (reason: {str(e)})')
-
     # all done
     update_state(state=states.SUCCESS, message=f'[Epoch {epoch}] averaged {len(queryResult)} model states')
 
@@ -420,14 +617,7 @@ def _call_inference(project, imageIDs, epoch, numEpochs, modelInstance, modelLib
     update_state = __get_message_fun(project, len(imageIDs), 0, epoch, numEpochs)
 
     # get project's prediction type
-    projectMeta = dbConnector.execute(sql.SQL('''
-            SELECT predictionType
-            FROM aide_admin.project
-            WHERE shortname = %s;
-        '''),
-        (project,),
-        1)
-    predType = projectMeta[0]['predictiontype']
+    predType = __get_project_meta(project, dbConnector)['predictiontype']
 
     # load model state
     update_state(state='PREPARING', message=f'[Epoch {epoch}] loading model state')
@@ -438,17 +628,28 @@ def _call_inference(project, imageIDs, epoch, numEpochs, modelInstance, modelLib
         raise Exception(f'[Epoch {epoch}] error during model state loading (reason: {str(e)})')
 
     # if batch size limit specified: split imageIDs into chunks and process in smaller batches
+    # (chunks are sliced on demand instead of being materialized upfront)
     if isinstance(batchSizeLimit, int) and batchSizeLimit > 0:
-        imageID_chunks = array_split(imageIDs, batchSizeLimit)
+        chunkSize = batchSizeLimit
     else:
-        imageID_chunks = [imageIDs]
+        chunkSize = max(1, len(imageIDs))
+    numChunks = max(1, -(-len(imageIDs) // chunkSize))
+
+    # prediction fields (identical for all batches)
+    fieldNames = list(getattr(FieldNames_prediction, predType).value)
+    fieldNames.append('image')      # image ID
+    fieldNames.append('cnnstate')   # model state ID
+    fieldNames = tuple(fieldNames)
+    getters = __get_prediction_field_getters(fieldNames, predType, stateDictID)
 
     # process in batches
-    for idx, imageID_batch in enumerate(imageID_chunks):
-        chunkStr = f'{idx+1}/{len(imageID_chunks)}'
+    for idx in range(numChunks):
+        imageID_batch = imageIDs[idx*chunkSize:(idx+1)*chunkSize]
+        chunkStr = f'{idx+1}/{numChunks}'
         print(f'Chunk {chunkStr}')
 
-        update_state = __get_message_fun(project, len(imageIDs), idx*batchSizeLimit, epoch, numEpochs)
+        if idx > 0:
+            update_state.offset = idx*chunkSize
 
         # load remaining data (image filenames, class definitions)
         update_state(state='PREPARING', message=f'[Epoch {epoch}] loading metadata (chunk {chunkStr})')
@@ -478,83 +679,27 @@ def _call_inference(project, imageIDs, epoch, numEpochs, modelInstance, modelLib
         # parse result
         try:
             update_state(state='FINALIZING', message=f'[Epoch {epoch}] saving predictions (chunk {chunkStr})')
-            fieldNames = list(getattr(FieldNames_prediction, predType).value)
-            fieldNames.append('image')      # image ID
-            fieldNames.append('cnnstate')   # model state ID
             values_pred = []
             values_img = []     # mostly for feature vectors
-            for imgID in result.keys():
-                for prediction in result[imgID]['predictions']:
-
-                    # if segmentation mask: encode
-                    if predType == 'segmentationMasks':
-                        segMask = np.array(result[imgID]['predictions'][0]['label']).astype(np.uint8)
-                        height, width = segMask.shape
-                        segMask = base64.b64encode(segMask.ravel()).decode('utf-8')
-                        segMaskDimensions = {
-                            'width': width,
-                            'height': height
-                        }
-
-                    nextResultValues = []
+            for imgID, imgResult in result.items():
+                if predType != 'segmentationMasks':
                     # we expect a dict of values, so we can use the fieldNames directly
-                    for fn in fieldNames:
-                        if fn == 'image':
-                            nextResultValues.append(imgID)
-                            # ids_img.append(imgID)
-                        elif fn == 'cnnstate':
-                            nextResultValues.append(stateDictID)
-                        elif fn == 'segmentationmask':
-                            nextResultValues.append(segMask)
-                        elif fn == 'width' or fn == 'height':
-                            if predType == 'segmentationMasks':
-                                nextResultValues.append(segMaskDimensions[fn])
-                            elif fn in prediction:
-                                nextResultValues.append(prediction[fn])
-                            else:
-                                nextResultValues.append(None)
-                        elif fn == 'priority':
-                            value = None
-                            if fn in prediction and prediction[fn] is None and 'confidence' in prediction:
-                                # ranker somehow didn't assign value; use confidence by default
-                                value = prediction['confidence']
-                            elif fn in prediction:
-                                value = prediction[fn]
-                            else:
-                                #TODO: provide replacement for priority, e.g. in case of segmentation masks
-                                value = None
-                            
-                            if isinstance(value, list) or isinstance(value, np.ndarray):
-                                # segmentation masks, etc.: array of values provided; take average instead
-                                try:
-                                    value = np.nanmean(np.array(value))
-                                except:
-                                    value = None
-                            nextResultValues.append(value)
-                        elif fn == 'confidence':
-                            value = None
-                            if fn in prediction:
-                                value = prediction[fn]
-                                if isinstance(value, list) or isinstance(value, np.ndarray):
-                                    # segmentation masks, etc.: array of values provided; take average instead
-                                    try:
-                                        value = np.nanmean(np.array(value))
-                                    except:
-                                        value = None
-                            nextResultValues.append(value)
-                        else:
-                            if fn in prediction:
-                                #TODO: might need to do typecasts (e.g. UUID?)
-                                nextResultValues.append(prediction[fn])
-
-                            else:
-                                # field name is not in return value; might need to raise a warning, Exception, or set to None
-                                nextResultValues.append(None)
-                            
-                    values_pred.append(tuple(nextResultValues))
-
-                if 'fVec' in result[imgID] and len(result[imgID]['fVec']):
-                    values_img.append((imgID, psycopg2.Binary(result[imgID]['fVec']),))
+                    values_pred.extend([tuple([g(prediction, imgID, None, None) for g in getters]) for prediction in imgResult['predictions']])
+
+                elif len(imgResult['predictions']):
+                    # segmentation mask: encode once per image (the mask is shared by all predictions)
+                    # np.asarray avoids a copy if the model already returns a uint8 array
+                    segMask = np.asarray(imgResult['predictions'][0]['label'], dtype=np.uint8)
+                    height, width = segMask.shape
+                    segMask = base64.b64encode(segMask.ravel()).decode('utf-8')
+                    segMaskDimensions = {
+                        'width': width,
+                        'height': height
+                    }
+                    values_pred.extend([tuple([g(prediction, imgID, segMask, segMaskDimensions) for g in getters]) for prediction in imgResult['predictions']])
+
+                if 'fVec' in imgResult and len(imgResult['fVec']):
+                    values_img.append((imgID, psycopg2.Binary(imgResult['fVec']),))
         except Exception as e:
             print(e)
             raise Exception(f'[Epoch {epoch}] error during result parsing (chunk {chunkStr}, reason: {str(e)})')
@@ -562,21 +707,17 @@ def _call_inference(project, imageIDs, epoch, numEpochs, modelInstance, modelLib
 
         # commit to database
         try:
-            if len(values_pred):
-                queryStr = sql.SQL('''
-                    INSERT INTO {id_pred} ( {fieldNames} )
-                    VALUES %s;
-                ''').format(
-                    id_pred=sql.Identifier(project, 'prediction'),
-                    fieldNames=sql.SQL(',').join([sql.SQL(f) for f in fieldNames]))
-                dbConnector.insert(queryStr, values_pred)
+            # replace predictions of a previous, unacknowledged run of this chunk (tasks are acked late and may be re-delivered);
+            # deletion and insertion are committed together, so that a failure leaves the previous predictions intact
+            queryStr_delete = None
+            if stateDictID is not None and len(imageID_batch):
+                queryStr_delete = __sql_delete_predictions(project)
+            if queryStr_delete is not None or len(values_pred):
+                dbConnector.delete_insert(queryStr_delete, (stateDictID, tuple(imageID_batch),),
+                                        __sql_insert_predictions(project, fieldNames), values_pred, page_size=1000)
 
             if len(values_img):
-                queryStr = sql.SQL('''
-                    INSERT INTO {} ( id, fVec )
-                    VALUES %s
-                    ON CONFLICT (id) DO UPDATE SET fVec = EXCLUDED.fVec;
-                ''').format(sql.Identifier(project, 'image'))
+                queryStr = __sql_upsert_feature_vectors(project)
                 dbConnector.insert(queryStr, values_img)
         except Exception as e:
             print(e)
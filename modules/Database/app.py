@@ -5,13 +5,76 @@
 '''
 
 from contextlib import contextmanager
+import struct
+import uuid
 import psycopg2
+from psycopg2 import sql
 from psycopg2.pool import ThreadedConnectionPool
 from psycopg2.extras import RealDictCursor, execute_values
 psycopg2.extras.register_uuid()
 from util.helpers import LogDecorator
 
 
+class _BinaryCopyStream:
+    '''
+        File-like object that serializes rows into PostgreSQL's binary COPY
+        format on the fly, as read by "cursor.copy_expert". Supports NULL,
+        booleans, bytes-like objects (bytea), strings (text types) and UUIDs.
+    '''
+    HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+    TRAILER = struct.pack('!h', -1)
+
+    def __init__(self, rows):
+        self.buffers = self._serialize(rows)
+        self.current = memoryview(b'')
+
+
+    @staticmethod
+    def _encode(value):
+        if value is None:
+            return None
+        elif isinstance(value, bool):
+            return (b'\x01' if value else b'\x00')
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            return memoryview(value).cast('B')
+        elif isinstance(value, str):
+            return value.encode('utf-8')
+        elif isinstance(value, uuid.UUID):
+            return value.bytes
+        raise TypeError(f'Unsupported type for binary COPY: "{type(value)}".')
+
+
+    def _serialize(self, rows):
+        yield self.HEADER
+        for row in rows:
+            yield struct.pack('!h', len(row))
+            for value in row:
+                value = self._encode(value)
+                if value is None:
+                    yield struct.pack('!i', -1)
+                else:
+                    yield struct.pack('!i', len(value))
+                    yield value
+        yield self.TRAILER
+
+
+    def read(self, size=-1):
+        chunks = []
+        remaining = size
+        while size < 0 or remaining > 0:
+            if not len(self.current):
+                try:
+                    self.current = memoryview(next(self.buffers))
+                except StopIteration:
+                    break
+            numBytes = (len(self.current) if size < 0 else min(remaining, len(self.current)))
+            chunks.append(self.current[:numBytes])
+            self.current = self.current[numBytes:]
+            remaining -= numBytes
+        return b''.join(chunks)
+
+
+
 class Database():
 
     def __init__(self, config, verbose_start=False):
@@ -145,11 +208,11 @@ class Database():
     
 
 
-    def insert(self, query, values, numReturn=None):
+    def insert(self, query, values, numReturn=None, page_size=100):
         with self._get_connection() as conn:
             cursor = conn.cursor()
             try:
-                execute_values(cursor, query, values)
+                execute_values(cursor, query, values, page_size=page_size)
                 conn.commit()
             except Exception as e:
                 if not conn.closed:
@@ -160,7 +223,7 @@ class Database():
                 conn = self.connectionPool.getconn()
                 try:
                     cursor = conn.cursor(cursor_factory=RealDictCursor)
-                    execute_values(cursor, query, values)
+                    execute_values(cursor, query, values, page_size=page_size)
                     conn.commit()
                 except Exception as e:
                     if not conn.closed:
@@ -189,4 +252,77 @@ class Database():
                     # cursor.close()
                     return returnValues
             except Exception as e:
-                print(e)
\ No newline at end of file
+                print(e)
+
+
+
+    def execute_checked(self, query, arguments, numReturn=None):
+        '''
+            Like "execute", but the statement is not retried and an Exception
+            is raised if it fails, instead of only being printed. Meant for
+            statements whose failure must abort the calling task.
+        '''
+        with self._get_connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                cursor.execute(query, arguments)
+                conn.commit()
+            except:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            if numReturn is None:
+                return
+            elif numReturn == 'all':
+                return cursor.fetchall()
+            else:
+                return cursor.fetchmany(numReturn)
+
+
+
+    def delete_insert(self, deleteQuery, deleteArguments, insertQuery, values, page_size=100):
+        '''
+            Executes "deleteQuery" (unless None) and inserts "values" through
+            "insertQuery" (as in "insert") within a single transaction, so
+            that either both or none of the statements take effect.
+            Raises an Exception if any of the statements fails.
+        '''
+        with self._get_connection() as conn:
+            conn.autocommit = False
+            cursor = conn.cursor()
+            try:
+                if deleteQuery is not None:
+                    cursor.execute(deleteQuery, deleteArguments)
+                if len(values):
+                    execute_values(cursor, insertQuery, values, page_size=page_size)
+                conn.commit()
+            except:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                if not conn.closed:
+                    conn.autocommit = True
+
+
+
+    def copy_binary(self, query, rows, size=2**20):
+        '''
+            Inserts "rows" (an iterable of tuples) through a
+            "COPY ... FROM STDIN WITH (FORMAT binary)" statement ("query").
+            Unlike "insert", values are not escaped into the query text,
+            which avoids hex-encoding (and duplicating) large bytea values
+            such as model states.
+            Raises an Exception if the statement fails.
+        '''
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                if isinstance(query, sql.Composable):
+                    query = query.as_string(cursor)
+                cursor.copy_expert(query, _BinaryCopyStream(rows), size=size)
+                conn.commit()
+            except:
+                if not conn.closed:
+                    conn.rollback()
+                raise
@@ -70,13 +70,13 @@ def toNumber(value):
 
 
 def array_split(arr, size):
-     arrs = []
-     while len(arr) > size:
-         pice = arr[:size]
-         arrs.append(pice)
-         arr = arr[size:]
-     arrs.append(arr)
-     return arrs
+    '''
+        Splits "arr" into consecutive chunks of (at most) "size" elements.
+        Always returns at least one (possibly empty) chunk.
+    '''
+    if len(arr) <= size:
+        return [arr]
+    return [arr[idx:idx+size] for idx in range(0, len(arr), size)]
 
 
 